@@ -45,6 +45,7 @@ def convert_to_str(val):
 class ProcessingConfig(BaseModel):
     num_processes: Optional    [  int         ] = 4
     gap_tolerance: Optional    [  int         ] = 60
+    max_workers  : Optional    [  int         ] = 8
     logging      : Optional    [  str         ] = None
 
 class AuthConfig(BaseModel):
@@ -206,6 +207,7 @@ class SeismoLoaderSettings(BaseModel):
         # Parse the PROCESSING section
         num_processes = config.getint('PROCESSING', 'num_processes', fallback=4)
         gap_tolerance = config.getint('PROCESSING', 'gap_tolerance', fallback=60)
+        max_workers = config.getint('PROCESSING', 'max_workers', fallback=8)
         download_type_str = config.get('PROCESSING', 'download_type', fallback='event')
         download_type = DownloadType(download_type_str.lower())
 
@@ -361,7 +363,8 @@ class SeismoLoaderSettings(BaseModel):
             download_type=download_type,
             proccess=ProcessingConfig(
                 num_processes=num_processes,
-                gap_tolerance=gap_tolerance
+                gap_tolerance=gap_tolerance,
+                max_workers=max_workers
             ),
             auths=lst_auths,
             waveform=waveform,
@@ -386,6 +389,7 @@ class SeismoLoaderSettings(BaseModel):
         config['PROCESSING'] = {
             'num_processes': convert_to_str(self.proccess.num_processes),
             'gap_tolerance': convert_to_str(self.proccess.gap_tolerance),
+            'max_workers': convert_to_str(self.proccess.max_workers),
             'download_type': convert_to_str(self.download_type.value)
         }
 
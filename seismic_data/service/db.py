@@ -1,11 +1,14 @@
+import os
+import time
 import sqlite3
 import contextlib
-import time
-import random
+import itertools
+import threading
 
 
 def setup_database(db_path):
     conn = sqlite3.connect(db_path)
+    configure_connection(conn)
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS archive_data (
@@ -22,31 +25,108 @@ def setup_database(db_path):
         CREATE INDEX IF NOT EXISTS idx_archive_data 
         ON archive_data (network, station, location, channel, starttime, endtime)
         ''')
+    setup_query_cache(conn)
     conn.commit()
     return
 
+def configure_connection(conn):
+    """Apply the per-connection pragmas used for all archive database access."""
+    conn.execute('PRAGMA journal_mode=WAL')    # readers don't block the writer (persisted in the file)
+    conn.execute('PRAGMA busy_timeout=30000')  # let SQLite wait on locks instead of raising
+    conn.execute('PRAGMA synchronous=NORMAL')  # safe with WAL, avoids an fsync per commit
+    conn.execute('PRAGMA temp_store=MEMORY')
+    conn.execute('PRAGMA cache_size=-65536')   # 64 MB page cache (negative = KiB)
+    conn.execute('PRAGMA mmap_size=268435456') # read pages through a 256 MB memory map
+
+# Open connections, one per database path, cached per thread (and per process)
+_local = threading.local()
+
+def get_db_connection(db_path):
+    """Return this thread's connection to db_path, opening and configuring it on first use."""
+    pid = os.getpid()
+    if getattr(_local, 'pid', None) != pid:
+        # Never reuse a connection inherited from the parent of a forked worker
+        _local.pid = pid
+        _local.conns = {}
+
+    key = os.path.abspath(db_path)
+    conn = _local.conns.get(key)
+    if conn is None:
+        conn = sqlite3.connect(db_path, timeout=20)
+        configure_connection(conn)
+        _local.conns[key] = conn
+    return conn
+
+def close_db_connections():
+    """Close the connections opened by the current thread."""
+    for conn in getattr(_local, 'conns', {}).values():
+        conn.close()
+    _local.conns = {}
+
 @contextlib.contextmanager
-def safe_db_connection(db_path, max_retries=3, initial_delay=1):
-    """Context manager for safe database connections with retry mechanism."""
-    retry_count = 0
-    delay = initial_delay
-    while retry_count < max_retries:
-        try:
-            conn = sqlite3.connect(db_path, timeout=20)
-            yield conn
-            return
-        except sqlite3.OperationalError as e:
-            if "database is locked" in str(e):
-                retry_count += 1
-                if retry_count >= max_retries:
-                    print(f"Failed to connect to database after {max_retries} retries.")
-                    raise
-                print(f"Database is locked. Retrying in {delay} seconds...")
-                time.sleep(delay)
-                delay *= 2  # Exponential backoff
-                delay += random.uniform(0, 1)  # Add jitter
-            else:
-                raise
-        finally:
-            if 'conn' in locals():
-                conn.close()
\ No newline at end of file
+def safe_db_connection(db_path):
+    """
+    Context manager yielding the cached database connection.
+    Lock contention is waited out by SQLite itself (busy_timeout, see configure_connection).
+    """
+    conn = get_db_connection(db_path)
+    try:
+        yield conn
+    except BaseException:
+        # The connection outlives this block, so don't leave a half-done transaction on it
+        conn.rollback()
+        raise
+
+
+def bulk_insert_archive_data(conn, archive_iter, chunk_size=10000):
+    """
+    Insert (network, station, location, channel, starttime, endtime) rows from any iterable,
+    consuming it lazily and committing one transaction per chunk. None entries are skipped.
+    Returns the number of rows inserted.
+    """
+    cursor = conn.cursor()
+    rows = filter(None, archive_iter)
+    inserted = 0
+    while True:
+        chunk = list(itertools.islice(rows, chunk_size))
+        if not chunk:
+            break
+        cursor.executemany('''
+            INSERT OR REPLACE INTO archive_data 
+            (network, station, location, channel, starttime, endtime)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', chunk)
+        conn.commit()
+        inserted += len(chunk)
+    return inserted
+
+
+def setup_query_cache(conn, max_age=None):
+    """
+    Create the table of cached FDSN query results, if it isn't there (databases made before it existed).
+    Given max_age (seconds), results older than that are deleted too, as they'd never be used again.
+    """
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS query_cache (
+            key TEXT PRIMARY KEY,
+            payload BLOB,
+            fetched_at REAL
+            )
+        ''')
+    if max_age is not None:
+        conn.execute('DELETE FROM query_cache WHERE fetched_at < ?', (time.time() - max_age,))
+        conn.commit()
+
+def get_cached_query(conn, key, max_age):
+    """Payload stored under key by cache_query, or None if there is none at most max_age seconds old (older ones are dropped)."""
+    setup_query_cache(conn, max_age)
+    row = conn.execute('SELECT payload FROM query_cache WHERE key = ? AND fetched_at >= ?',
+                       (key, time.time() - max_age)).fetchone()
+    return row[0] if row else None
+
+def cache_query(conn, key, payload):
+    """Store (or refresh) the payload for key."""
+    setup_query_cache(conn)
+    conn.execute('INSERT OR REPLACE INTO query_cache (key, payload, fetched_at) VALUES (?, ?, ?)',
+                 (key, payload, time.time()))
+    conn.commit()
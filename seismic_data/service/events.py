@@ -10,7 +10,6 @@ We should also be able to support multi-select areas.
 
 import pandas as pd
 import streamlit as st
-import requests
 
 from seismic_data.models.config import SeismoLoaderSettings
 from seismic_data.service.seismoloader import get_events
@@ -27,33 +26,17 @@ def event_response_to_df(data):
     """
     @TODO: base on response from FSDN, below should be re-written
     """
-    records = []
-    for event in data:
-        # Extract the preferred origin (location info)
-        origin = event.preferred_origin() or event.origins[0]
-        magnitude = event.preferred_magnitude() or event.magnitudes[0]
-        
-        # Extract location (longitude, latitude, depth)
-        longitude = origin.longitude
-        latitude = origin.latitude
-        depth = origin.depth / 1000  # Convert depth to kilometers
-
-        # Extract the time and place
-        time = origin.time.datetime
-        place = event.event_descriptions[0].text if event.event_descriptions else "Unknown place"
-        
-        # Extract the magnitude
-        mag = magnitude.mag
-
-        # Create the record dictionary
-        record = {
-            'place': place,
-            'magnitude': mag,
-            'time': pd.to_datetime(time),  # Convert to pandas datetime
-            'longitude': longitude,
-            'latitude': latitude,
-            'depth': depth  # in kilometers
-        }
-        
-        records.append(record)
-    return pd.DataFrame(records)
\ No newline at end of file
+    # Resolve each event's preferred origin and magnitude exactly once
+    origins    = [event.preferred_origin() or event.origins[0] for event in data]
+    magnitudes = [event.preferred_magnitude() or event.magnitudes[0] for event in data]
+
+    # Build the frame column-wise from the resolved objects
+    return pd.DataFrame({
+        'place'    : [event.event_descriptions[0].text if event.event_descriptions else "Unknown place"
+                      for event in data],
+        'magnitude': [magnitude.mag for magnitude in magnitudes],
+        'time'     : pd.to_datetime([origin.time.datetime for origin in origins]),  # Convert to pandas datetime
+        'longitude': [origin.longitude for origin in origins],
+        'latitude' : [origin.latitude for origin in origins],
+        'depth'    : [origin.depth / 1000 for origin in origins]  # in kilometers
+    })
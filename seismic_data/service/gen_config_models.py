@@ -1,13 +1,31 @@
+import io
+import os
 import configparser
+from ast import literal_eval
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import indent
 
 file_paths = ['example_event.cfg', 'example_continuous.cfg']
+model_path = 'config_model.py'
 
-def merge_configs():
+def read_config(path):
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+
+def read_configs():
+    # Read the files concurrently; map() keeps file order so earlier files still win
+    with ThreadPoolExecutor(max_workers=len(file_paths)) as executor:
+        return list(executor.map(read_config, file_paths))
+
+
+def merge_configs(configs=None):
     master_config = configparser.ConfigParser()
-    for path in file_paths:
-        config = configparser.ConfigParser()
-        config.read(path)
+    if configs is None:
+        configs = read_configs()
+
+    for config in configs:
         for section in config.sections():
             if not master_config.has_section(section):
                 master_config.add_section(section)
@@ -17,31 +35,72 @@ def merge_configs():
     return master_config
 
 
+def infer_field_type(value):
+    """ Infer the field type of a single config value, falling back to str """
+    if value is None:
+        return 'str'
+    value = value.strip()
+    if value.lower() in ('true', 'false'):
+        return 'bool'
+    try:
+        parsed = literal_eval(value)
+    except (ValueError, SyntaxError):
+        return 'str'
+    if isinstance(parsed, bool):
+        return 'bool'
+    if isinstance(parsed, int):
+        return 'int'
+    if isinstance(parsed, float):
+        return 'float'
+    return 'str'
+
+
+def infer_field_types(configs, section, key):
+    """
+    Field type for section/key that accepts its value in every config file setting it (empty values don't count).
+    int only if every file's value is an int; if some are float the field is widened to float.
+    """
+    types = {infer_field_type(config.get(section, key)) for config in configs
+             if config.has_option(section, key) and config.get(section, key)}
+    if types == {'int', 'float'}:
+        return 'float'
+    if len(types) == 1:
+        return types.pop()
+    return 'str'
+
+
 def generate_pydantic_model_from_config():
 
-    config = merge_configs()
-    classes = []
+    configs = read_configs()
+    config = merge_configs(configs)
+    buf = io.StringIO()
+    buf.write("from pydantic import BaseModel, ConfigDict\n\n")
     
-    # Generate class definitions based on sections
-    for section in config.sections():
+    # Generate class definitions based on sections, separated by a blank line
+    for i, section in enumerate(config.sections()):
+        if i > 0:
+            buf.write("\n")
         class_name = ''.join(word.title() for word in section.split('_')) + 'Config'
-        field_definitions = []
-        for key, _ in config.items(section):
-            field_type = 'str'  # Default to str, you can enhance this to infer type
-            field_line = f"{key}: {field_type}"
-            field_definitions.append(field_line)
-        
-        class_body = "\n    ".join(field_definitions)
-        class_definition = f"class {class_name}(BaseModel):\n    {class_body}\n"
-        classes.append(class_definition)
-    
-    # Combine all class definitions into a single module
-    full_model = "\n".join(classes)
-    model_code = f"from pydantic import BaseModel\n\n{full_model}"
+        buf.write(f"class {class_name}(BaseModel):\n")
+        # Frozen models are hashable, so they can be used directly as cache keys
+        buf.write("    model_config = ConfigDict(frozen=True)\n")
+        for key, value in config.items(section):
+            field_type = infer_field_types(configs, section, key)
+            buf.write(f"    {key}: {field_type}\n")
     
-    
-    with open('config_model.py', 'w') as f:
+    model_code = buf.getvalue()
+
+    # Leave the module (and its cached bytecode) untouched if nothing changed
+    if os.path.exists(model_path):
+        with open(model_path) as f:
+            if f.read() == model_code:
+                return
+
+    # Write to a temp file and swap it in so readers never see a partial module
+    tmp_path = model_path + '.tmp'
+    with open(tmp_path, 'w') as f:
         f.write(model_code)
+    os.replace(tmp_path, model_path)
 
 
 if __name__ == "__main__":
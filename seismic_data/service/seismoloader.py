@@ -10,13 +10,22 @@
 # ver 0.2 08/2024
 # - first shared edition
 
+import io
 import os
+import re
 import sys
-import time
+import json
+import hashlib
+import struct
 import sqlite3
 import datetime
+import functools
+import threading
 import multiprocessing
+from itertools import compress
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import configparser
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from tabulate import tabulate # non-standard. this is just to display the db contents
@@ -25,8 +34,9 @@ from typing import List
 
 import obspy
 from obspy.clients.fdsn import Client
+from obspy.clients.fdsn.header import FDSNNoDataException
 from obspy.geodetics.base import locations2degrees
-from obspy import UTCDateTime
+from obspy import UTCDateTime, Stream
 from obspy.taup import TauPyModel
 from obspy.core.inventory import Inventory
 from obspy.core.event import Catalog
@@ -34,7 +44,7 @@ from obspy.core.event import Catalog
 from seismic_data.models.config import SeismoLoaderSettings, SeismoQuery
 from seismic_data.enums.config import DownloadType, GeoConstraintType
 from seismic_data.service.utils import is_in_enum
-from seismic_data.service.db import setup_database, safe_db_connection
+from seismic_data.service.db import setup_database, safe_db_connection, bulk_insert_archive_data, get_cached_query, cache_query, close_db_connections
 from seismic_data.service.waveform import get_local_waveform, stream_to_dataframe
 
 ### request status codes (TBD more:
@@ -53,25 +63,170 @@ def read_config(config_file):
     config = CustomConfigParser(allow_no_value=True)
     config.read(config_file)
     
-    # Process the config, preserving case for [AUTH] and converting others to lowercase
-    processed_config = CustomConfigParser(allow_no_value=True)
-    
+    # Process the config in place, preserving case for [AUTH] and converting others to lowercase
+    # (items() folds the [DEFAULT] values into every section, so those are dropped afterwards)
     for section in config.sections():
-        processed_config.add_section(section)
-        for key, value in config.items(section):
-            if section == 'AUTH':
-                # Preserve case for both key and value in AUTH section
-                processed_key = key
-                processed_value = value if value is not None else None
-            else:
-                # Convert to lowercase for other sections
-                processed_key = key.lower()
-                processed_value = value.lower() if value is not None else None
-            
-            processed_config.set(section, processed_key, processed_value)
+        items = config.items(section)
+        for key in config.options(section):
+            config.remove_option(section, key)
+        for key, value in items:
+            if section != 'AUTH':
+                key = key.lower()
+                value = value.lower() if value is not None else None
+            config.set(section, key, value)
+    config.defaults().clear()
+
+    return config
+
+
+
+# MiniSEED fixed header fields from byte 20: BTIME start (year, julday, hour, minute, second, unused,
+# 0.0001 s), number of samples, sample rate factor and multiplier, activity flags, I/O flags, data
+# quality flags, number of blockettes, time correction, beginning of data, first blockette
+MSEED_HEADER = {order: struct.Struct(order + 'HHBBBxHHhhBxxBlxxH') for order in '><'}
+MSEED_BLOCKETTE = {order: struct.Struct(order + 'HH') for order in '><'}
+MSEED_HEADER_BYTES = 128  # enough for the fixed header plus blockettes 1000/1001
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# The usual record layout (as written by obspy/libmseed): fixed header, blockette 1000 at byte 48,
+# optionally blockette 1001 at byte 56. Lets a whole file of records be read as one numpy array.
+MSEED_RECORD_FIELDS = [
+    ('year', 'u2', 20), ('julday', 'u2', 22), ('hour', 'u1', 24), ('minute', 'u1', 25), ('second', 'u1', 26),
+    ('tenth_ms', 'u2', 28), ('nsamples', 'u2', 30), ('factor', 'i2', 32), ('multiplier', 'i2', 34),
+    ('activity', 'u1', 36), ('n_blockettes', 'u1', 39), ('time_correction', 'i4', 40), ('first_blockette', 'u2', 46),
+    ('b1000_type', 'u2', 48), ('b1000_next', 'u2', 50), ('b1000_reclen', 'u1', 54),
+    ('b1001_type', 'u2', 56), ('b1001_microsecond', 'i1', 61),
+]
+
+def mseed_records_time_range(data, order, reclen):
+    """
+    (start_ns, end_ns) over all the fixed-length records in data, parsed together with numpy.
+    Returns None unless every record has the usual layout (see MSEED_RECORD_FIELDS).
+    """
+    if reclen < 64:
+        return None
+    names, formats, offsets = zip(*MSEED_RECORD_FIELDS)
+    dtype = np.dtype({'names': names, 'formats': [order + f for f in formats], 'offsets': offsets, 'itemsize': reclen})
+    rec = np.frombuffer(data, dtype=dtype)
+
+    has_1001 = rec['n_blockettes'] == 2
+    if not (np.all(rec['first_blockette'] == 48) and np.all(rec['b1000_type'] == 1000)
+            and np.all(rec['b1000_reclen'].astype(np.int64) < 31) and np.all(2 ** rec['b1000_reclen'].astype(np.int64) == reclen)
+            and np.all((rec['n_blockettes'] == 1) | has_1001)
+            and np.all(~has_1001 | ((rec['b1000_next'] == 56) & (rec['b1001_type'] == 1001)))
+            and np.all(rec['nsamples'] > 0)):
+        return None
+
+    factor = rec['factor'].astype(float)
+    multiplier = rec['multiplier'].astype(float)
+    if np.any(factor == 0) or np.any(multiplier == 0):
+        return None
+    # Same sign rules as parse_mseed_record_header
+    sampling_rate = np.where(factor > 0,
+                             np.where(multiplier > 0, factor * multiplier, -factor / multiplier),
+                             np.where(multiplier > 0, -multiplier / factor, 1.0 / (factor * multiplier)))
+
+    year_start = (rec['year'].astype(np.int64) - 1970).astype('datetime64[Y]').astype('datetime64[D]').astype(np.int64)
+    field = lambda name: rec[name].astype(np.int64) # no overflow in the arithmetic below
+    days = year_start + field('julday') - 1
+    seconds = days * 86400 + field('hour') * 3600 + field('minute') * 60 + field('second')
+    start_ns = ((seconds * 10000 + field('tenth_ms')) * 100000
+                + np.where(has_1001, rec['b1001_microsecond'], 0).astype(np.int64) * 1000)
+    correction = (rec['time_correction'] != 0) & ~(rec['activity'] & 0x02).astype(bool)
+    start_ns += np.where(correction, rec['time_correction'].astype(np.int64) * 100000, 0)
+    end_ns = start_ns + np.round((1.0 / sampling_rate) * (rec['nsamples'] - 1.0) * 1e9).astype(np.int64)
+
+    return int(start_ns.min()), int(end_ns.max())
+
+def parse_mseed_record_header(buf, order):
+    """
+    Parse the fixed header (and blockettes 1000/1001) at the start of a MiniSEED record.
+    Returns (start_ns, end_ns, record_length) or None if the record can't be handled here.
+    """
+    if len(buf) < 48:
+        return None
+    (year, julday, hour, minute, second, tenth_ms, nsamples, factor, multiplier,
+     activity, n_blockettes, time_correction, next_blockette) = MSEED_HEADER[order].unpack_from(buf, 20)
+
+    reclen = None
+    microsecond = 0
+    for _ in range(n_blockettes):
+        if not 48 <= next_blockette <= len(buf) - 8:
+            break
+        b_type, b_next = MSEED_BLOCKETTE[order].unpack_from(buf, next_blockette)
+        if b_type == 1000:
+            reclen = 2 ** buf[next_blockette + 6]
+        elif b_type == 1001:
+            microsecond = struct.unpack_from('b', buf, next_blockette + 5)[0]
+        elif b_type == 100:
+            return None  # actual sample rate overrides factor/multiplier; leave to obspy
+        next_blockette = b_next
+
+    if reclen is None or nsamples == 0:
+        return None
 
-    return processed_config
+    if factor > 0 and multiplier > 0:
+        sampling_rate = float(factor * multiplier)
+    elif factor > 0 and multiplier < 0:
+        sampling_rate = -factor / multiplier
+    elif factor < 0 and multiplier > 0:
+        sampling_rate = -multiplier / factor
+    elif factor < 0 and multiplier < 0:
+        sampling_rate = 1.0 / (factor * multiplier)
+    else:
+        return None
+
+    days = datetime.date(year, 1, 1).toordinal() + julday - 1 - EPOCH_ORDINAL
+    start_ns = (((days * 86400 + hour * 3600 + minute * 60 + second) * 10000 + tenth_ms) * 100000
+                + microsecond * 1000)
+    if time_correction and not activity & 0x02:
+        start_ns += time_correction * 100000  # correction not yet applied to the start time
+    end_ns = start_ns + int(round((1.0 / sampling_rate) * (nsamples - 1) * 1e9))
 
+    return start_ns, end_ns, reclen
+
+def read_mseed_time_range(file_path):
+    """
+    Get the start and end time of a MiniSEED file from its record headers, without decoding any
+    data or building ObsPy traces. Every record's header is read, as a day file can hold several
+    traces (e.g. contained or overlapping ones kept by merge(method=-1)) and the last record need
+    not be the one ending latest.
+
+    Returns (starttime, endtime) as UTCDateTime, or None if the file is not plain fixed-length
+    MiniSEED that can be handled here (callers should fall back to obspy.read).
+    """
+    with open(file_path, 'rb') as f:
+        data = f.read()
+    if len(data) < 48:
+        return None
+
+    # Byte order is not flagged in the header; pick the one giving a sane year / day of year
+    for order in '><':
+        year, julday = struct.unpack(order + 'HH', data[20:24])
+        if 1900 <= year <= 2100 and 1 <= julday <= 366:
+            break
+    else:
+        return None
+
+    first = parse_mseed_record_header(data[:MSEED_HEADER_BYTES], order)
+    if first is None or len(data) % first[2]:
+        return None
+    reclen = first[2]
+
+    span = mseed_records_time_range(data, order, reclen)
+    if span is not None:
+        return UTCDateTime(ns=span[0]), UTCDateTime(ns=span[1])
+
+    # Less usual record layouts, one record at a time
+    start_ns, end_ns = first[0], first[1]
+    for offset in range(reclen, len(data), reclen):
+        record = parse_mseed_record_header(data[offset:offset + MSEED_HEADER_BYTES], order)
+        if record is None or record[2] != reclen:
+            return None
+        start_ns = min(start_ns, record[0])
+        end_ns = max(end_ns, record[1])
+
+    return UTCDateTime(ns=start_ns), UTCDateTime(ns=end_ns)
 
 
 def process_file(file_path):
@@ -83,15 +238,26 @@ def process_file(file_path):
         
         network, station, location, channel, _, year, dayfolder = parts
         
-        # Read the file to get actual start and end times
-        st = obspy.read(file_path, headonly=True)
-        
-        if len(st) == 0:
-            print(f"Warning: No traces found in {file_path}")
-            return None
-        
-        start_time = min(tr.stats.starttime for tr in st)
-        end_time = max(tr.stats.endtime for tr in st)
+        # Get the actual start and end times from every record header (files may hold several traces)
+        time_range = read_mseed_time_range(file_path)
+        if time_range:
+            start_time, end_time = time_range
+        else:
+            # Not something the header parser handles, read it via obspy
+            # SDS files are always MiniSEED, skip format and compression detection
+            st = obspy.read(file_path, format='MSEED', headonly=True, check_compression=False)
+            
+            if len(st) == 0:
+                print(f"Warning: No traces found in {file_path}")
+                return None
+            
+            if len(st) == 1:
+                # Usual case of one trace per day file, no need to scan
+                start_time = st[0].stats.starttime
+                end_time = st[0].stats.endtime
+            else:
+                start_time = min(tr.stats.starttime for tr in st)
+                end_time = max(tr.stats.endtime for tr in st)
         
         return (network, station, location, channel, start_time.isoformat(), end_time.isoformat())
     
@@ -100,49 +266,105 @@ def process_file(file_path):
         return None
 
 
-## TODO add a "files newer than" search filter
+# SDS file names have 7 dot-separated parts: NET.STA.LOC.CHAN.TYPE.YEAR.DAY
+SDS_FILENAME = re.compile(r'(?:[^.]*\.){6}[^.]*')
+
+def list_sds_dir(path):
+    """ os.scandir entries of path, or none (with a message) if it can't be read, so one bad directory doesn't stop the scan (as with os.walk) """
+    try:
+        with os.scandir(path) as entries:
+            return list(entries)
+    except OSError as e:
+        print(f"Error reading directory {path}: {str(e)}")
+        return []
+
+def is_new_sds_file(entry, newer_than):
+    if not SDS_FILENAME.fullmatch(entry.name):
+        return False
+    try:
+        return newer_than is None or entry.stat().st_mtime > newer_than
+    except OSError as e:
+        print(f"Error reading file {entry.path}: {str(e)}")
+        return False
+
+def scan_sds_files(path, newer_than=None):
+    """
+    Recursively yield SDS file paths under path (not following directory symlinks, like os.walk).
+    If newer_than (epoch seconds) is given, only files modified after it are yielded.
+    os.scandir entries carry their type and cache their stat, so there is no extra stat per file.
+    """
+    for entry in list_sds_dir(path):
+        if entry.is_dir(follow_symlinks=False):
+            yield from scan_sds_files(entry.path, newer_than)
+        elif is_new_sds_file(entry, newer_than):
+            yield entry.path
+
+
+def scan_sds_archive(sds_path, newer_than=None, max_workers=16):
+    """
+    List all SDS file paths under sds_path, scanning subdirectories in parallel.
+    The walk is bound by per-directory latency (notably on network filesystems) and scandir/stat
+    release the GIL, so threads fan out over the YEAR/NET directories (SDS is YEAR/NET/STA/CHAN.TYPE/).
+    Files come back in no particular order.
+    """
+    file_paths = []
+    if not os.path.isdir(sds_path):
+        return file_paths # nothing archived yet (os.walk was silent about this too)
+    subdirs = [sds_path]
+    for _ in range(2):
+        next_subdirs = []
+        for path in subdirs:
+            for entry in list_sds_dir(path):
+                if entry.is_dir(follow_symlinks=False):
+                    next_subdirs.append(entry.path)
+                elif is_new_sds_file(entry, newer_than):
+                    file_paths.append(entry.path)
+        subdirs = next_subdirs
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(lambda path: list(scan_sds_files(path, newer_than)), path) for path in subdirs]
+        for future in as_completed(futures):
+            file_paths.extend(future.result())
+    return file_paths
+
+
 ## TODO remove data where original SDS files no longer exist?
 ## this can take a long time for someone with a serious archive already (5TB / 768235 files = ~8-12 hours at 4 cores)
-def populate_database_from_sds(sds_path, db_path, num_processes=None):
+def populate_database_from_sds(sds_path, db_path, num_processes=None, newer_than=None):
+    """
+    Scan an SDS archive and add the time span of every file to the database.
+    :param newer_than: Only process files modified after this time (anything UTCDateTime accepts)
+    """
     if num_processes is None:
         num_processes = multiprocessing.cpu_count()
+    if newer_than is not None:
+        newer_than = UTCDateTime(newer_than).timestamp
     
     # Collect all file paths
-    file_paths = []
-    for root, dirs, files in os.walk(sds_path):
-        for file in files:
-            file_paths.append(os.path.join(root, file))
+    file_paths = scan_sds_archive(sds_path, newer_than)
     
     total_files = len(file_paths)
     print(f"Found {total_files} files to process.")
     
     # Process files with or without multiprocessing (currently having issues with OSX and undoubtably windows is going to be a bigger problem TODO TODO)
+    # Only the pool itself falls back to serial processing; database errors are not pool failures and are raised
+    results = None
     if num_processes > 1:
+        # Hand out files in chunks so the per-task pickling/IPC is amortised; order doesn't matter
+        chunksize = max(1, total_files // (num_processes * 16))
         try:
             with multiprocessing.Pool(processes=num_processes) as pool:
-                results = list(tqdm(pool.imap(process_file, file_paths), total=total_files, desc="Processing files"))
+                results = list(tqdm(pool.imap_unordered(process_file, file_paths, chunksize=chunksize),
+                                    total=total_files, desc="Processing files"))
         except Exception as e:
             print(f"Multiprocessing failed: {str(e)}. Falling back to single-process execution.")
-            num_processes = 1
-    else:
-        results = []
-        for fp in tqdm(file_paths, desc="Processing files"):
-            results.append(process_file(fp))
 
-    # Filter out None results and insert into database
+    if results is None:
+        # Serially, results are streamed straight into the database as they come
+        results = tqdm(map(process_file, file_paths), total=total_files, desc="Processing files")
+
     with safe_db_connection(db_path) as conn:
-        cursor = conn.cursor()
-        
-        inserted = 0
-        for result in tqdm(filter(None, results), total=len(results), desc="Inserting into database"):
-            cursor.execute('''
-                INSERT OR REPLACE INTO archive_data 
-                (network, station, location, channel, starttime, endtime)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', result)
-            inserted += 1
-        
-        conn.commit()
+        inserted = bulk_insert_archive_data(conn, results)
 
     print(f"Processed {total_files} files, inserted {inserted} records into the database.")
 
@@ -153,67 +375,76 @@ def join_continuous_segments(db_path, gap_tolerance=60):
     
     :param db_path: Path to the SQLite database
     :param gap_tolerance: Maximum allowed gap (in seconds) to still consider segments continuous
+
+    Requires SQLite 3.25+ (window functions).
     """
     with safe_db_connection(db_path) as conn:
         cursor = conn.cursor()
-        
-        # Fetch all data sorted by network, station, location, channel, and starttime
+
+        cursor.execute('DROP TABLE IF EXISTS temp.joined_segments')
         cursor.execute('''
-            SELECT id, network, station, location, channel, starttime, endtime
-            FROM archive_data
-            ORDER BY network, station, location, channel, starttime
+            CREATE TEMP TABLE joined_segments (
+                id INTEGER PRIMARY KEY,
+                head_id INTEGER,
+                segment_end TEXT
+            )
         ''')
-        
-        all_data = cursor.fetchall()
-        
-        to_delete = []
-        to_update = []
-        current_segment = None
-        
-        for row in all_data:
-            id, network, station, location, channel, starttime, endtime = row
-            starttime = UTCDateTime(starttime)
-            endtime = UTCDateTime(endtime)
-            
-            if current_segment is None:
-                current_segment = list(row)
-            else:
-                # Check if this segment is continuous with the current one
-                if (network == current_segment[1] and
-                    station == current_segment[2] and
-                    location == current_segment[3] and
-                    channel == current_segment[4] and
-                    starttime - UTCDateTime(current_segment[6]) <= gap_tolerance):
-                    
-                    # Extend the current segment
-                    current_segment[6] = max(endtime, UTCDateTime(current_segment[6])).isoformat()
-                    to_delete.append(id)
-                else:
-                    # Start a new segment
-                    to_update.append(tuple(current_segment))
-                    current_segment = list(row)
-        
-        # Don't forget the last segment
-        if current_segment:
-            to_update.append(tuple(current_segment))
-        
-        # Perform the updates
-        cursor.executemany('''
+
+        # Label each row with its segment, entirely inside SQLite: per channel and in starttime order,
+        # a new segment starts where the gap to the latest endtime seen so far exceeds gap_tolerance
+        # (compared in whole milliseconds, SQLite's date precision). Each row then gets the id of
+        # its segment's first row and the segment's overall endtime.
+        cursor.execute('''
+            WITH running AS (
+                SELECT id, network, station, location, channel, starttime, endtime,
+                       MAX(endtime) OVER (
+                           PARTITION BY network, station, location, channel
+                           ORDER BY starttime, id
+                           ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING
+                       ) AS prev_end
+                FROM archive_data
+            ),
+            labelled AS (
+                SELECT *, SUM(
+                           CASE WHEN prev_end IS NULL
+                                  OR CAST(ROUND((julianday(starttime) - julianday(prev_end)) * 86400000) AS INTEGER) > ?
+                                THEN 1 ELSE 0 END
+                       ) OVER (
+                           PARTITION BY network, station, location, channel
+                           ORDER BY starttime, id
+                           ROWS UNBOUNDED PRECEDING
+                       ) AS segment
+                FROM running
+            )
+            INSERT INTO joined_segments (id, head_id, segment_end)
+            SELECT id,
+                   FIRST_VALUE(id) OVER (
+                       PARTITION BY network, station, location, channel, segment
+                       ORDER BY starttime, id
+                   ),
+                   MAX(endtime) OVER (PARTITION BY network, station, location, channel, segment)
+            FROM labelled
+        ''', (round(gap_tolerance * 1000),))
+
+        # Extend the first row of every segment to cover the whole segment
+        cursor.execute('''
             UPDATE archive_data
-            SET endtime = ?
-            WHERE id = ?
-        ''', [(row[6], row[0]) for row in to_update])
-        
+            SET endtime = (SELECT segment_end FROM joined_segments WHERE joined_segments.id = archive_data.id)
+            WHERE id IN (SELECT id FROM joined_segments WHERE id = head_id)
+        ''')
+        updated = cursor.rowcount
+
         # Delete the merged segments
-        if to_delete:
-            cursor.execute(f'''
-                DELETE FROM archive_data
-                WHERE id IN ({','.join('?' * len(to_delete))})
-            ''', to_delete)
-        
+        cursor.execute('''
+            DELETE FROM archive_data
+            WHERE id IN (SELECT id FROM joined_segments WHERE id != head_id)
+        ''')
+        deleted = cursor.rowcount
+
+        cursor.execute('DROP TABLE temp.joined_segments')
         conn.commit()
     
-    print(f"Joined segments. Deleted {len(to_delete)} rows, updated {len(to_update)} rows.")
+    print(f"Joined segments. Deleted {deleted} rows, updated {updated} rows.")
 
 def reset_id_counter(db_path, table_name):
     """
@@ -322,60 +553,96 @@ def populate_database_from_sds_old(sds_path, db_path):
 def collect_requests(inv, time0, time1, days_per_request=5):
     """ Collect all requests required to download everything in inventory, split into 5-day periods """
     requests = []  # network, station, location, channel, starttime, endtime
+    step = datetime.timedelta(days=days_per_request)
+    one_day = datetime.timedelta(days=1)
 
     for net in inv:
+        net_code = net.code
         for sta in net:
+            sta_code = sta.code
             for cha in sta:
                 start_date = max(time0, cha.start_date.date)
                 if cha.end_date:
-                    end_date = min(time1 - (1/cha.sample_rate), cha.end_date.date + datetime.timedelta(days=1))
+                    end_date = min(time1 - (1/cha.sample_rate), cha.end_date.date + one_day)
                 else:
                     end_date = time1
+                loc_code = cha.location_code
+                cha_code = cha.code
                 
                 current_start = start_date
+                start_str = current_start.isoformat() + "Z"
                 while current_start < end_date:
-                    current_end = min(current_start + datetime.timedelta(days=days_per_request), end_date)
+                    current_end = min(current_start + step, end_date)
+                    end_str = current_end.isoformat() + "Z"
                     
                     requests.append((
-                        net.code,
-                        sta.code,
-                        cha.location_code,
-                        cha.code,
-                        current_start.isoformat() + "Z",
-                        current_end.isoformat() + "Z" ))
+                        net_code,
+                        sta_code,
+                        loc_code,
+                        cha_code,
+                        start_str,
+                        end_str ))
                     
-                    current_start = current_end
+                    # each window starts where the last one ended, so reuse its string
+                    current_start, start_str = current_end, end_str
     return requests
 
 # Requests for shorter, event-based data
-def get_p_s_times(eq,sta_lat,sta_lon,ttmodel):
-    eq_lat = eq.origins[0].latitude
-    eq_lon = eq.origins[0].longitude
-    eq_depth = eq.origins[0].depth / 1000 # TODO confirm this is in meters
-    dist_deg = locations2degrees(sta_lat,sta_lon,eq_lat,eq_lon) # probably already calculated at this stage
-
+ttmodels = {} # model name -> TauPyModel, each loaded once and shared (loading a model takes a while)
+
+def ttmodel_name(ttmodel):
+    """ Name a TauPyModel is registered under in ttmodels, e.g. 'iasp91' """
+    name = np.asarray(ttmodel.model.s_mod.v_mod.model_name).item() # stored as a 0-d numpy bytes array
+    return name.decode() if isinstance(name, bytes) else str(name)
+
+def get_ttmodel(model_name='iasp91'):
+    """ TauPyModel for model_name, from ttmodels (loaded on first use) """
+    model_name = str(model_name)
+    if model_name not in ttmodels:
+        ttmodels[model_name] = TauPyModel(model=model_name)
+    return ttmodels[model_name]
+
+# Travel times are cached per model on a 0.1 km depth / 0.01 degree distance grid, well below what
+# matters for the request windows, as many station/event pairs land in the same bin
+@functools.lru_cache(maxsize=8192)
+def get_p_s_durations(model_name,depth_km,dist_deg):
+    """ P and S travel times in seconds (None if not available) for a given depth and distance """
+    ttmodel = get_ttmodel(model_name)
     try:
-        phasearrivals = ttmodel.get_travel_times(source_depth_in_km=eq_depth,distance_in_degree=dist_deg,phase_list=['ttbasic']) #ttp or "ttbasic" or ttall may want to try S picking eventually
-    except:
+        phasearrivals = ttmodel.get_travel_times(source_depth_in_km=depth_km,distance_in_degree=dist_deg,phase_list=['ttbasic']) #ttp or "ttbasic" or ttall may want to try S picking eventually
+    except Exception:
         try:
             phasearrivals = ttmodel.get_travel_times(source_depth_in_km=0,distance_in_degree=dist_deg,phase_list=['ttbasic']) #possibly depth issue if negetive.. OK we only need to "close" anyway
-        except:
+        except Exception:
             return None,None
 
     try:
         p_duration = phasearrivals[0].time #seconds it takes for p-wave to reach station
-    except: #TODO print enough info to explain why.. many possible reasons!
+    except Exception: #TODO print enough info to explain why.. many possible reasons!
         p_duration = None
 
-    p_arrival_time = eq.origins[0].time + p_duration
-    
     # TBH we aren't really concerned with S arrivals, but while we're here, may as well (TODO future use)
     try:
         s_duration = phasearrivals[1].time
-    except:
+    except Exception:
         s_duration = None
 
-    s_arrival_time = eq.origins[0].time + s_duration
+    return p_duration,s_duration
+
+def get_p_s_times(eq,sta_lat,sta_lon,ttmodel,dist_deg=None):
+    eq_lat = eq.origins[0].latitude
+    eq_lon = eq.origins[0].longitude
+    eq_depth = eq.origins[0].depth / 1000 # TODO confirm this is in meters
+    if dist_deg is None: # callers that already filtered by distance pass it in
+        dist_deg = locations2degrees(sta_lat,sta_lon,eq_lat,eq_lon)
+
+    # Callers may pass in a model they loaded themselves; register it so the cached lookup finds it by name
+    model_name = ttmodel_name(ttmodel)
+    ttmodels.setdefault(model_name, ttmodel)
+    p_duration, s_duration = get_p_s_durations(model_name,round(eq_depth,1),round(dist_deg,2))
+
+    p_arrival_time = eq.origins[0].time + p_duration if p_duration is not None else None
+    s_arrival_time = eq.origins[0].time + s_duration if s_duration is not None else None
 
     return p_arrival_time,s_arrival_time
 
@@ -387,21 +654,47 @@ def TOFIX__output_best_channels(nn,sta,t):
                 print("get_best_nslc: not station input!")
                 return sta.channels
         if len(sta) <=1 : return sta.channels
-        CHs = set([ele.code[0:2] for ele in sta.channels])
+        CHs = {ele.code[0:2] for ele in sta.channels}
         if len(CHs) == 1:
                 return [sta.channels[0]]
 
         # Re-assess what channels are avail. these should be sorted by samplerate with the highest first. that should be enough for most cases, but...
 
+        # Group channels by band/instrument code once, so each rank is a dict lookup rather than a scan of every channel
+        by_prefix = {}
         for cha in sta.channels:
-            if cha.end_date is None: cha.end_date = UTCDateTime(2099,1,1) # Easiest to replace all "None" with "far off into future"
-        CHs = set([tr.stats.channel[0:2] for tr in st])
+            by_prefix.setdefault(cha.code[0:2], []).append(cha)
+        far_future = UTCDateTime(2099,1,1) # Easiest to treat all "None" end dates as "far off into future"
         for ch in cha_rank:
-            selection = [ele for ele in sta.channels if ele.code[0:2] == ch and ele.start_date <= t <= ele.end_date]
+            selection = [ele for ele in by_prefix.get(ch, ()) if ele.start_date <= t <= (ele.end_date or far_future)]
             if selection: return selection
         print("no valid channels found in output_best_channels")
         return []
 
+def active_stations(inv, time):
+    """
+    (network, station, channels) for every station in inv operating at time, with only its channels
+    operating at time. Same filtering as inv.select(time=time), without copying the inventory.
+    """
+    stations = []
+    for net in inv:
+        if not net.is_active(time=time):
+            continue
+        for sta in net:
+            if not sta.is_active(time=time):
+                continue
+            channels = [cha for cha in sta if cha.is_active(time=time)]
+            if sta.channels and not channels:
+                continue # as select() does, drop stations left with no channels
+            stations.append((net, sta, channels))
+    return stations
+
+def station_distances(stations, lat, lon):
+    """ Distances in degrees from lat/lon to each station of active_stations(), in one vectorised call """
+    lats = np.array([sta.latitude for _, sta, _ in stations], dtype=float)
+    lons = np.array([sta.longitude for _, sta, _ in stations], dtype=float)
+    return locations2degrees(lats,lons,lat,lon)
+
 def collect_requests_event(eq,inv,min_dist_deg=30,max_dist_deg=90,before_p_sec=10,after_p_sec=120,model=None): #todo add params for before_p, after_p, etc
     """ collect all requests for data in inventory for given event eq """
 
@@ -409,30 +702,36 @@ def collect_requests_event(eq,inv,min_dist_deg=30,max_dist_deg=90,before_p_sec=1
 
     origin = eq.origins[0] # default to the primary I suppose (possible TODO but don't see why anyone would want anything else)
     ot = origin.time
-    sub_inv = inv.select(time = ot) # Loose filter to select only stations that were running during the earthquake start
+    stations = active_stations(inv, ot) # Loose filter to select only stations that were running during the earthquake start
 
     # TODO: further filter by selecting best available channels
 
-    requests_per_eq = []
-    for net in sub_inv:
-        for sta in net:
-            dist_deg = locations2degrees(sta.latitude,sta.longitude,origin.latitude,origin.longitude)
-            if dist_deg < min_dist_deg or dist_deg > max_dist_deg:
-                continue
-            p_time, s_time = get_p_s_times(eq,sta.latitude,sta.longitude,model)
-            if not p_time: continue # TOTO need error msg also
+    if model is None:
+        model = get_ttmodel()
 
-            t_start = p_time - abs(before_p_sec)
-            t_end = p_time + abs(after_p_sec)
+    # Station coordinates as arrays, so the distance filter is a single vectorised call
+    if not stations:
+        return []
+    dists = station_distances(stations,origin.latitude,origin.longitude)
+    in_range = (dists >= min_dist_deg) & (dists <= max_dist_deg)
 
-            for cha in sta: # TODO will have to had filtered channels prior to this, else will grab them all
-                requests_per_eq.append((
-                    net.code,
-                    sta.code,
-                    cha.location_code,
-                    cha.code,
-                    t_start.isoformat() + "Z",
-                    t_end.isoformat() + "Z" ))
+    requests_per_eq = []
+    for (net, sta, channels), dist_deg in zip(compress(stations, in_range), dists[in_range]):
+        p_time, s_time = get_p_s_times(eq,sta.latitude,sta.longitude,model,float(dist_deg))
+        if not p_time: continue # TOTO need error msg also
+
+        # Same window for every channel, so format it once per station
+        t_start = (p_time - abs(before_p_sec)).isoformat() + "Z"
+        t_end = (p_time + abs(after_p_sec)).isoformat() + "Z"
+
+        for cha in channels: # TODO will have to had filtered channels prior to this, else will grab them all
+            requests_per_eq.append((
+                net.code,
+                sta.code,
+                cha.location_code,
+                cha.code,
+                t_start,
+                t_end ))
 
     return requests_per_eq
 
@@ -451,40 +750,51 @@ def collect_requests_event_revised(eq,inv,before_p_sec=10,after_p_sec=120,model=
 
     origin = eq.origins[0] # default to the primary I suppose (possible TODO but don't see why anyone would want anything else)
     ot = origin.time
-    sub_inv = inv.select(time = ot) # Loose filter to select only stations that were running during the earthquake start
+    stations = active_stations(inv, ot) # Loose filter to select only stations that were running during the earthquake start
 
     # TODO: further filter by selecting best available channels
 
-    requests_per_eq = []
-    for net in sub_inv:
-        for sta in net:
-            p_time, s_time = get_p_s_times(eq,sta.latitude,sta.longitude,model)
-            if not p_time: continue # TOTO need error msg also
+    if model is None:
+        model = get_ttmodel()
 
-            t_start = p_time - abs(before_p_sec)
-            t_end = p_time + abs(after_p_sec)
+    if not stations:
+        return []
+    dists = station_distances(stations,origin.latitude,origin.longitude)
 
-            for cha in sta: # TODO will have to had filtered channels prior to this, else will grab them all
-                requests_per_eq.append((
-                    net.code,
-                    sta.code,
-                    cha.location_code,
-                    cha.code,
-                    t_start.isoformat() + "Z",
-                    t_end.isoformat() + "Z" ))
+    requests_per_eq = []
+    for (net, sta, channels), dist_deg in zip(stations, dists):
+        p_time, s_time = get_p_s_times(eq,sta.latitude,sta.longitude,model,float(dist_deg))
+        if not p_time: continue # TOTO need error msg also
+
+        # Same window for every channel, so format it once per station
+        t_start = (p_time - abs(before_p_sec)).isoformat() + "Z"
+        t_end = (p_time + abs(after_p_sec)).isoformat() + "Z"
+
+        for cha in channels: # TODO will have to had filtered channels prior to this, else will grab them all
+            requests_per_eq.append((
+                net.code,
+                sta.code,
+                cha.location_code,
+                cha.code,
+                t_start,
+                t_end ))
 
     return requests_per_eq
 
 
 
 from collections import defaultdict
-def combine_requests(requests):
+# Upper limit on stations in one combined request; bigger ones risk being refused or timing out at
+# the server, and smaller ones spread better over the archive_requests workers
+MAX_STATIONS_PER_REQUEST = 50
+
+def combine_requests(requests, max_stations=MAX_STATIONS_PER_REQUEST):
     """ Combine requests to 
     1) Minimize how many and 
     2) Not include data already present in our database (unless intentionally overwriting) 
     Requests can be combined for multiple stations/channels by comma separation BHZ,BHN,BHE
     it is possible to also extend the times, but we also don't want the requests to be too large
-    so, we'll group by matching time only
+    so, we'll group by matching time only, and split groups of more than max_stations stations
     """
     # Group requests by network and time range
     groups = defaultdict(list)
@@ -494,78 +804,151 @@ def combine_requests(requests):
     # Combine requests for each group
     combined_requests = []
     for (net, t0, t1), items in groups.items():
-        # Combine stations, locations, and channels
-        stas = set()
-        locs = set()
-        chans = set()
+        # Stations in the group, each with the locations and channels requested for it
+        by_station = defaultdict(list)
         for sta, loc, chan in items:
-            stas.add(sta)
-            locs.add(loc)
-            chans.add(chan)
-        
-        # Create the combined request
-        combined_requests.append((
-            net,
-            ','.join(sorted(stas)),
-            ','.join(sorted(locs)),
-            ','.join(sorted(chans)),
-            t0,
-            t1
-        ))
+            by_station[sta].append((loc, chan))
+        stations = sorted(by_station)
+
+        for i in range(0, len(stations), max_stations):
+            stas = stations[i:i + max_stations]
+            # Combine locations and channels (transposed in one go, then deduplicated)
+            locs, chans = map(set, zip(*(pair for sta in stas for pair in by_station[sta])))
+
+            # Create the combined request
+            combined_requests.append((
+                net,
+                ','.join(stas),
+                ','.join(sorted(locs)),
+                ','.join(sorted(chans)),
+                t0,
+                t1
+            ))
     
     return combined_requests
 
+def iso_to_timestamp(iso):
+    """ Epoch seconds for an ISO time string as stored in the database (UTC, no offset) """
+    return datetime.datetime.fromisoformat(iso).replace(tzinfo=datetime.timezone.utc).timestamp()
+
+def request_time_to_timestamp(t):
+    """
+    Epoch seconds for a request time. Requests normally carry ISO strings ("...Z"), which are parsed
+    directly as that is an order of magnitude quicker; anything else goes through UTCDateTime
+    """
+    if isinstance(t, str):
+        try:
+            dt = datetime.datetime.fromisoformat(t[:-1] if t.endswith('Z') else t)
+        except ValueError:
+            return UTCDateTime(t).timestamp
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc)
+        return dt.timestamp()
+    return UTCDateTime(t).timestamp
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+def timestamp_to_iso(timestamp):
+    """ Inverse of iso_to_timestamp, formatted the same as UTCDateTime.isoformat() """
+    # Plain offset from the (naive, UTC) epoch; no timezone/localtime conversion involved
+    return (EPOCH + datetime.timedelta(seconds=timestamp)).isoformat()
+
 def prune_requests(requests, db_path, min_request_window=2):
     """
     Remove any overlapping requests where already-archived data (via db_path) may exist 
     If any requests are less than min_request_window seconds, ignore
     """
     pruned_requests = []
-    
+    if not requests:
+        return pruned_requests
+
+    # Parse the request times once
+    # All the gap arithmetic below is done on epoch seconds, with the ISO strings parsed directly
+    parsed_requests = []
+    for req in requests:
+        parsed_requests.append((req, request_time_to_timestamp(req[4]), request_time_to_timestamp(req[5])))
+
+    # Load the requests into a temp table and join it against the archive, so all overlapping
+    # archived spans come back from one query (each request is an index range scan)
+    existing = defaultdict(list)  # request index -> [(starttime, endtime)] sorted by starttime
     with safe_db_connection(db_path) as conn:
         cursor = conn.cursor()
-        
-        for req in requests:
-            network, station, location, channel, start_time, end_time = req
-            start_time = UTCDateTime(start_time)
-            end_time = UTCDateTime(end_time)
-            
-            # Query the database for existing data
-            cursor.execute('''
-                SELECT starttime, endtime FROM archive_data
-                WHERE network = ? AND station = ? AND location = ? AND channel = ?
-                AND endtime >= ? AND starttime <= ?
-                ORDER BY starttime
-            ''', (network, station, location, channel, start_time.isoformat(), end_time.isoformat()))
-            
-            existing_data = cursor.fetchall()
-            
-            if not existing_data:
-                # If no existing data, keep the entire request
-                pruned_requests.append(req)
-            else:
-                # Process gaps in existing data
-                current_time = start_time
-                for db_start, db_end in existing_data:
-                    db_start = UTCDateTime(db_start)
-                    db_end = UTCDateTime(db_end)
-                    
-                    if current_time < db_start - min_request_window:
-                        # There's a gap before this existing data
-                        pruned_requests.append((network, station, location, channel, 
-                                                current_time.isoformat(), db_start.isoformat()))
-                    
-                    current_time = max(current_time, db_end)
-                
-                if current_time < end_time - min_request_window:
-                    # There's a gap after the last existing data
+        cursor.execute('DROP TABLE IF EXISTS temp.pending_requests')
+        cursor.execute('''
+            CREATE TEMP TABLE pending_requests (
+                id INTEGER PRIMARY KEY,
+                network TEXT, station TEXT, location TEXT, channel TEXT,
+                starttime TEXT, endtime TEXT
+            )
+        ''')
+        cursor.executemany('INSERT INTO pending_requests VALUES (?, ?, ?, ?, ?, ?, ?)',
+                           ((i, *req[:4], timestamp_to_iso(start_time), timestamp_to_iso(end_time))
+                            for i, (req, start_time, end_time) in enumerate(parsed_requests)))
+        cursor.execute('''
+            SELECT r.id, a.starttime, a.endtime
+            FROM pending_requests r
+            JOIN archive_data a
+              ON a.network = r.network AND a.station = r.station
+             AND a.location = r.location AND a.channel = r.channel
+             AND a.endtime >= r.starttime AND a.starttime <= r.endtime
+            ORDER BY r.id, a.starttime
+        ''')
+        for i, db_start, db_end in cursor:
+            existing[i].append((iso_to_timestamp(db_start), iso_to_timestamp(db_end)))
+        cursor.execute('DROP TABLE temp.pending_requests')
+        conn.commit()
+
+    for i, (req, start_time, end_time) in enumerate(parsed_requests):
+        network, station, location, channel = req[:4]
+        existing_data = existing.get(i)
+
+        if not existing_data:
+            # If no existing data, keep the entire request
+            pruned_requests.append(req)
+        else:
+            # Process gaps in existing data
+            current_time = start_time
+            for db_start, db_end in existing_data:
+                if current_time < db_start - min_request_window:
+                    # There's a gap before this existing data
                     pruned_requests.append((network, station, location, channel, 
-                                            current_time.isoformat(), end_time.isoformat()))
+                                            timestamp_to_iso(current_time), timestamp_to_iso(db_start)))
+                
+                current_time = max(current_time, db_end)
+            
+            if current_time < end_time - min_request_window:
+                # There's a gap after the last existing data
+                pruned_requests.append((network, station, location, channel, 
+                                        timestamp_to_iso(current_time), timestamp_to_iso(end_time)))
     
     return pruned_requests
 
+def stream_covers_file(stream, time_range):
+    """
+    True if stream is a single gap-free trace spanning all the data already in a file with the
+    given (start, end) time range, in which case merging with the file is pointless and it can just be overwritten.
+    time_range must span every record in the file (read_mseed_time_range), not just the first and last.
+    """
+    if len(stream) != 1:
+        return False
+    return stream[0].stats.starttime <= time_range[0] and stream[0].stats.endtime >= time_range[1]
+
+def stream_follows_file(stream, time_range):
+    """
+    True if all of stream starts after the end of the data already in a file with the given (start, end) time range,
+    so it can be appended without overlapping anything. As above, time_range must span every record in the file.
+    """
+    return min(tr.stats.starttime for tr in stream) > time_range[1]
+
+# Requests run in parallel threads and consecutive requests share their boundary day,
+# so writes to an SDS day file are serialised on one of a fixed set of locks picked by path
+sds_file_locks = [threading.Lock() for _ in range(64)]
+
 def archive_request(request,waveform_client,sds_path,db_path):
-    """ Send a request to an FDSN center, parse it, save to archive, and update our database """
+    """
+    Send a request to an FDSN center, parse it, save to archive, and update our database
+    Returns the database rows for the files written; with db_path=None they are only returned, not inserted
+    """
     try:
         st = waveform_client.get_waveforms(network=request[0],station=request[1],
                             location=request[2],channel=request[3],
@@ -574,9 +957,11 @@ def archive_request(request,waveform_client,sds_path,db_path):
     except Exception as e:
         print(f"Error fetching data: {request} {str(e)}")
         # >> TODO add failure & denied to database also. can grep from HTTP status code (204 = no data, etc)
-        return
+        return []
 
-    #now loop through traces
+    # Split the traces into day pieces first, grouped by the SDS day file they belong in, so each
+    # file is read, merged and written once however many traces (i.e. gaps) fall in that day
+    traces_by_day = defaultdict(Stream)
     for tr in st:
         net = tr.stats.network
         sta = tr.stats.station
@@ -585,9 +970,6 @@ def archive_request(request,waveform_client,sds_path,db_path):
         starttime = tr.stats.starttime
         endtime = tr.stats.endtime
 
-        # Files to insert into database
-        to_insert_db = []
-
         # Generate file paths for each day covered by the trace
         current_time = UTCDateTime(starttime.date)
         while current_time < endtime:
@@ -599,47 +981,193 @@ def archive_request(request,waveform_client,sds_path,db_path):
             filename = f"{net}.{sta}.{loc}.{cha}.D.{year}.{doy:03d}"
             full_path = os.path.join(full_sds_path, filename)
 
-            # Create directory if it doesn't exist
-            os.makedirs(full_sds_path, exist_ok=True)
-
             # Calculate the end of the current day
             next_day = current_time + 86400 
             day_end = min(next_day - tr.stats.delta, endtime)  # Subtract one sample interval
 
             # Slice the trace for the current day
-            day_tr = tr.slice(current_time, day_end)
+            traces_by_day[full_path] += tr.slice(current_time, day_end)
+
+            current_time = next_day
+
+    # Files to insert into database
+    to_insert_db = []
+
+    for full_path, day_stream in traces_by_day.items():
+        # Create directory if it doesn't exist
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
 
-            if os.path.exists(full_path):
-                # If file exists, read it and merge with new data
-                existing_st = obspy.read(full_path)
-                existing_st += day_tr
+        # Join the day's pieces up first
+        if len(day_stream) > 1:
+            day_stream.merge(method=-1, fill_value=None)
+            day_stream._cleanup()
+
+        with sds_file_locks[hash(full_path) % len(sds_file_locks)]:
+            # Span of what's already there, from every record header without decoding data (None if no file, or not parseable)
+            time_range = read_mseed_time_range(full_path) if os.path.exists(full_path) else None
+
+            if not os.path.exists(full_path) or (time_range and stream_covers_file(day_stream, time_range)):
+                # If file doesn't exist (or the new data spans all of it), simply write the new data
+                day_stream.write(full_path, format="MSEED", reclen=4096, encoding='STEIM2')
+                print("  writing ", full_path)
+                file_st = day_stream
+                start_time = min(tr.stats.starttime for tr in file_st)
+            elif time_range and stream_follows_file(day_stream, time_range):
+                # MiniSEED is a plain sequence of records, so data that starts after the end of the file
+                # (the usual catch-up case) can be encoded on its own and appended, without re-encoding the file
+                with open(full_path, 'ab') as f:
+                    day_stream.write(f, format="MSEED", reclen=4096, encoding='STEIM2')
+                print("  appending ", full_path)
+                file_st = day_stream
+                start_time = time_range[0]
+            else:
+                # Otherwise read it and merge with new data
+                existing_st = obspy.read(full_path, format='MSEED', check_compression=False)
+                existing_st += day_stream
                 existing_st.merge(method=-1, fill_value=None)  # Merge, preserving gaps, no other QC
                 existing_st._cleanup() # gets rid of any overlaps, sub-sample jitter
                 existing_st.write(full_path, format="MSEED", reclen=4096, encoding='STEIM2')
                 print("  merging ", full_path)
-            else:
-                # If file doesn't exist, simply write the new data
-                day_tr.write(full_path, format="MSEED", reclen=4096, encoding='STEIM2')
-                print("  writing ", full_path)
-
-            current_time = next_day
+                file_st = existing_st
+                start_time = min(tr.stats.starttime for tr in file_st)
 
-            to_insert_db.append(process_file(full_path))
+        # What the file now spans is known from the data just written, no need to read it back (process_file)
+        stats = day_stream[0].stats
+        end_time = max(tr.stats.endtime for tr in file_st)
+        to_insert_db.append((stats.network, stats.station, stats.location, stats.channel,
+                             start_time.isoformat(), end_time.isoformat()))
 
+    if db_path:
         with safe_db_connection(db_path) as conn:
-            cursor = conn.cursor()
-            for ele in to_insert_db:
-                cursor.execute('''
-                    INSERT OR REPLACE INTO archive_data 
-                    (network, station, location, channel, starttime, endtime)
-                    VALUES (?, ?, ?, ?, ?, ?)
-                ''', ele)
-            conn.commit()
+            bulk_insert_archive_data(conn, to_insert_db)
+    return to_insert_db
 
 
+def archive_requests(requests,waveform_clients,sds_path,db_path,max_workers=8):
+    """
+    Run archive_request for each request in a thread pool. Each request is mostly waiting on
+    the FDSN server and the disk, so several can be in flight at once.
+    waveform_clients maps network codes to clients set up with that network's credentials, plus
+    'open' for everything else; a single client may also be given.
+    The workers don't touch the database; their rows are inserted from here (a single writer), each
+    request's committed as soon as it finishes so the database keeps up with the files on disk.
+    """
+    if not requests:
+        return
+
+    def request_rows(future):
+        request = futures[future]
+        try:
+            rows = future.result()
+            print(request)
+        except Exception as e:
+            print("Request not successful: ",request, str(e))
+            return []
+        return rows
+
+    if not isinstance(waveform_clients, dict):
+        waveform_clients = {'open':waveform_clients}
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(requests))))
+    futures = {}
+    recorded = set()
+    try:
+        futures = {executor.submit(archive_request,request,
+                                   waveform_clients.get(request[0], waveform_clients['open']),
+                                   sds_path,None): request
+                   for request in requests}
+        with safe_db_connection(db_path) as conn:
+            for future in as_completed(futures):
+                bulk_insert_archive_data(conn, request_rows(future))
+                recorded.add(future)
+    except BaseException:
+        # On ctrl-C (or any error) drop the queued requests rather than waiting for them all;
+        # those already running finish, and everything finished gets its rows in before giving up,
+        # as its files are already written
+        executor.shutdown(wait=True, cancel_futures=True)
+        with safe_db_connection(db_path) as conn:
+            for future in futures:
+                if future.done() and not future.cancelled() and future not in recorded:
+                    bulk_insert_archive_data(conn, request_rows(future))
+        raise
+    executor.shutdown()
+
 
 # MAIN RUN FUNCTIONS
 # ==================================================================
+class PerThreadClient:
+    """
+    Stands in for a Client with credentials that several threads use (archive_requests): each thread gets
+    its own Client, as urllib's digest auth handler keeps per-handler state that isn't thread-safe and
+    concurrent requests through one client fail with spurious 401s.
+    """
+    def __init__(self,base_url,user,password):
+        self.base_url = base_url
+        self.user = user
+        self.password = password
+        self.local = threading.local()
+        self.template = self.local.client = Client(base_url,user=user,password=password) # creating thread's, also checks the credentials work
+
+    def __getattr__(self, name):
+        client = getattr(self.local, 'client', None)
+        if client is None:
+            # archive_requests starts new threads for every event, so skip the service discovery
+            # (and its round trips) and take what the first client found
+            client = Client(self.base_url,user=self.user,password=self.password,_discover_services=False)
+            client.services = self.template.services
+            self.local.client = client
+        return getattr(client, name)
+
+@functools.lru_cache(maxsize=None)
+def get_client(base_url,user=None,password=None):
+    """
+    FDSN Client for base_url (and credentials), created once and shared. Creating a Client queries
+    the server for the services it offers, so get_stations, get_events and the run functions reuse them.
+    Clients with credentials are only shared within a thread (PerThreadClient).
+    """
+    if user is not None:
+        return PerThreadClient(base_url,user,password)
+    return Client(base_url,user=user,password=password)
+
+# Station and event queries for time windows already over are kept in the database for a day, so
+# re-running the same search (e.g. the CLI after exploring in the UI) doesn't ask the server again
+QUERY_CACHE_MAX_AGE = 24 * 3600
+
+def cached_query(db_path,client,method,fmt,**params):
+    """
+    client.<method>(**params), e.g. get_stations or get_events, read from the query cache in db_path if it
+    was asked in the last QUERY_CACHE_MAX_AGE seconds. Results are stored in obspy format fmt (STATIONXML / QUAKEML).
+    Queries without an endtime, or ending in the future, may still gain data so always go to the server.
+    """
+    endtime = params.get('endtime')
+    if not db_path or not os.path.exists(db_path) or endtime is None or UTCDateTime(endtime) > UTCDateTime():
+        return getattr(client,method)(**params)
+
+    # Same server, credentials, method and parameters = same result
+    key = hashlib.sha256(json.dumps([client.base_url, client.user, method, params],
+                                    sort_keys=True, default=str).encode()).hexdigest()
+    # The cache is only a shortcut: if it can't be read or written (locked, disk full, result too big
+    # for SQLite...) the query still goes to / comes from the server
+    try:
+        with safe_db_connection(db_path) as conn:
+            payload = get_cached_query(conn, key, QUERY_CACHE_MAX_AGE)
+        if payload is not None:
+            if fmt == 'QUAKEML':
+                return obspy.read_events(io.BytesIO(payload), format=fmt)
+            return obspy.read_inventory(io.BytesIO(payload), format=fmt)
+    except Exception as e:
+        print(f"Could not read query cache: {str(e)}")
+
+    result = getattr(client,method)(**params)
+    try:
+        buf = io.BytesIO()
+        result.write(buf, format=fmt)
+        with safe_db_connection(db_path) as conn:
+            cache_query(conn, key, buf.getvalue())
+    except Exception as e:
+        print(f"Could not cache query: {str(e)}")
+    return result
+
 def setup_paths(settings: SeismoLoaderSettings):
     sds_path = settings.sds_path # config['SDS']['sds_path']
     if not sds_path:
@@ -662,12 +1190,75 @@ def setup_paths(settings: SeismoLoaderSettings):
 
     return settings
 
+KM_PER_DEGREE = 111.32 # at the equator
+
 def convert_radius_to_degrees(radius_meters):
-    """ Convert radius from meters to degrees. """
-    kilometers = radius_meters / 1000
-    degrees = kilometers / 111.32
-    return degrees
+    """ Convert radius from meters to degrees (also works elementwise on numpy arrays). """
+    return radius_meters / (1000 * KM_PER_DEGREE)
+
+# Station queries run concurrently, but only a few at a time as many FDSN centres limit connections per client
+STATION_QUERY_WORKERS = 3
+
+def boxes_overlap(a, b):
+    """ True if two bounding-box coords overlap (boxes crossing the antimeridian are never merged) """
+    if a.min_lng > a.max_lng or b.min_lng > b.max_lng:
+        return False
+    return (a.min_lat <= b.max_lat and b.min_lat <= a.max_lat and
+            a.min_lng <= b.max_lng and b.min_lng <= a.max_lng)
+
+def group_overlapping(regions, overlap):
+    """ Split regions into groups joined by chains of overlap(a, b), so each group can be one query """
+    groups = []
+    for region in regions:
+        joined = [region]
+        for group in [g for g in groups if any(overlap(region, other) for other in g)]:
+            groups.remove(group)
+            joined.extend(group)
+        groups.append(joined)
+    return groups
+
+def filter_stations(inv, keep):
+    """
+    Drop the stations of inv for which keep(lats, lons) (arrays of station coordinates) is False,
+    and any networks that leaves empty. Modifies inv in place.
+    """
+    emptied = set()
+    for net in inv:
+        if not net.stations:
+            continue
+        lats = np.array([sta.latitude for sta in net], dtype=float)
+        lons = np.array([sta.longitude for sta in net], dtype=float)
+        net.stations = list(compress(net.stations, keep(lats, lons)))
+        if not net.stations:
+            emptied.add(id(net))
+    inv.networks = [net for net in inv if id(net) not in emptied]
+    return inv
 
+def circles_overlap(a, b):
+    """ True if the outer edges of two circle coords overlap """
+    return locations2degrees(a.lat, a.lng, b.lat, b.lng) <= \
+        convert_radius_to_degrees(a.max_radius) + convert_radius_to_degrees(b.max_radius)
+
+def in_any_circle(circles):
+    """ keep() for filter_stations: stations within the (min, max) radius of any of the circle coords """
+    def keep(lats, lons):
+        # stations x circles distance matrix, in one broadcast call
+        dists = locations2degrees(lats[:, None], lons[:, None],
+                                  np.array([c.lat for c in circles], dtype=float)[None, :],
+                                  np.array([c.lng for c in circles], dtype=float)[None, :])
+        min_r = np.array([convert_radius_to_degrees(c.min_radius) for c in circles], dtype=float)
+        max_r = np.array([convert_radius_to_degrees(c.max_radius) for c in circles], dtype=float)
+        return ((dists >= min_r) & (dists <= max_r)).any(axis=1)
+    return keep
+
+def in_any_box(boxes):
+    """ keep() for filter_stations: stations inside any of the bounding-box coords """
+    def keep(lats, lons):
+        mask = np.zeros(len(lats), dtype=bool)
+        for box in boxes:
+            mask |= (lats >= box.min_lat) & (lats <= box.max_lat) & (lons >= box.min_lng) & (lons <= box.max_lng)
+        return mask
+    return keep
 
 def get_stations(settings: SeismoLoaderSettings):
     """
@@ -675,11 +1266,11 @@ def get_stations(settings: SeismoLoaderSettings):
     """
     starttime = UTCDateTime(settings.station.date_config.start_time)
     endtime = UTCDateTime(settings.station.date_config.end_time)
-    waveform_client = Client(settings.waveform.client.value)
-    if settings.station and settings.station.client: # config['STATION']['client']:
-        station_client = Client(settings.station.client.value) # Client(config['STATION']['client'])
-    else:
-        station_client = waveform_client
+    # The client is only set up (a query to the server) when it's first needed, not for a local inventory
+    def station_client():
+        if settings.station and settings.station.client: # config['STATION']['client']:
+            return get_client(settings.station.client.value) # Client(config['STATION']['client'])
+        return get_client(settings.waveform.client.value)
 
     net = settings.station.network # config['STATION']['network']
     if not net:
@@ -701,42 +1292,79 @@ def get_stations(settings: SeismoLoaderSettings):
         inv = obspy.read_inventory(inventory)
 
     elif (not inventory and settings.station.geo_constraint):
+        # Query parameters shared by every geo constraint, built once; only the
+        # area-specific parameters differ per request
+        base_params = dict(
+            network=net,station=sta,
+            location=loc,channel=cha,
+            starttime=starttime,endtime=endtime,
+            includerestricted= settings.station.include_restricted, # config['STATION']['includerestricted'],
+            level=settings.station.level.value
+        )
+        # (area-specific parameters, station filter or None) per query
+        area_queries = []
+
+        # Overlapping boxes are fetched as one query over their combined extent, then cut back to the boxes
+        # themselves (also avoids the same station coming back twice). Needs station coordinates to cut by.
+        boxes = [geo.coords for geo in settings.station.geo_constraint if geo.geo_type == GeoConstraintType.BOUNDING]
+        if settings.station.level.value == 'network':
+            box_groups = [[box] for box in boxes]
+        else:
+            box_groups = group_overlapping(boxes, boxes_overlap)
+        for group in box_groups:
+            ## TODO Test if all variables exist / error if not
+            area_queries.append((dict(
+                minlatitude =min(box.min_lat for box in group), # float(config['STATION']['minlatitude']),
+                maxlatitude =max(box.max_lat for box in group),
+                minlongitude=min(box.min_lng for box in group),
+                maxlongitude=max(box.max_lng for box in group),
+            ), in_any_box(group) if len(group) > 1 else None))
+
+        # Likewise overlapping circles, as one circle around the first centre that takes them all in
+        circles = [geo.coords for geo in settings.station.geo_constraint if geo.geo_type == GeoConstraintType.CIRCLE]
+        if settings.station.level.value == 'network':
+            circle_groups = [[circle] for circle in circles]
+        else:
+            circle_groups = group_overlapping(circles, circles_overlap)
+        for group in circle_groups:
+            ## TODO Test if all variables exist / error if not
+            if len(group) == 1:
+                circle = group[0]
+                area_queries.append((dict(
+                    latitude = circle.lat, # float(config['STATION']['latitude']),
+                    longitude= circle.lng, # float(config['STATION']['longitude']),
+                    minradius=convert_radius_to_degrees(circle.min_radius), # float(config['STATION']['minradius']),
+                    maxradius=convert_radius_to_degrees (circle.max_radius), # float(config['STATION']['maxradius']),
+                ), None))
+                continue
+            center = group[0]
+            area_queries.append((dict(
+                latitude = center.lat,
+                longitude= center.lng,
+                minradius=0,
+                maxradius=min(180, max(locations2degrees(center.lat, center.lng, c.lat, c.lng) +
+                                       convert_radius_to_degrees(c.max_radius) for c in group)),
+            ), in_any_circle(group)))
+
         for geo in settings.station.geo_constraint:
-            if geo.geo_type == GeoConstraintType.BOUNDING:
-                    ## TODO Test if all variables exist / error if not  
-                curr_inv = station_client.get_stations(
-                    network=net,station=sta,
-                    location=loc,channel=cha,
-                    starttime=starttime,endtime=endtime,
-                    minlatitude =geo.coords.min_lat, # float(config['STATION']['minlatitude']),
-                    maxlatitude =geo.coords.max_lat,
-                    minlongitude=geo.coords.min_lng,
-                    maxlongitude=geo.coords.max_lng,
-                    includerestricted= settings.station.include_restricted, # config['STATION']['includerestricted'],
-                    level=settings.station.level.value
-                )
-            elif geo.geo_type == GeoConstraintType.CIRCLE:
-                ## TODO Test if all variables exist / error if not
-                curr_inv = station_client.get_stations(
-                    network=net,station=sta,
-                    location=loc,channel=cha,
-                    starttime=starttime,endtime=endtime,
-                    latitude = geo.coords.lat, # float(config['STATION']['latitude']),
-                    longitude= geo.coords.lng, # float(config['STATION']['longitude']),
-                    minradius=convert_radius_to_degrees(geo.coords.min_radius), # float(config['STATION']['minradius']),
-                    maxradius=convert_radius_to_degrees (geo.coords.max_radius), # float(config['STATION']['maxradius']),
-                    includerestricted=settings.station.include_restricted, # config['STATION']['includerestricted'],
-                    level=settings.station.level.value
-                )
-            else:
+            if geo.geo_type not in (GeoConstraintType.BOUNDING, GeoConstraintType.CIRCLE):
                 print(f"Unknown Geometry type: {geo.geo_type}")
 
-            if inv:
-                inv += curr_inv
-            else:
-                inv = curr_inv
+        def get_area_stations(query):
+            params, keep = query
+            curr_inv = cached_query(settings.db_path,client,'get_stations','STATIONXML',**base_params,**params)
+            return filter_stations(curr_inv, keep) if keep else curr_inv
+
+        # Each query is just a wait on the server, so send them together; results come back in order
+        client = station_client()
+        with ThreadPoolExecutor(max_workers=STATION_QUERY_WORKERS) as executor:
+            for curr_inv in executor.map(get_area_stations, area_queries):
+                if inv:
+                    inv += curr_inv
+                else:
+                    inv = curr_inv
     else: # No geographic constraint, search via inventory alone
-        inv = station_client.get_stations(
+        inv = cached_query(settings.db_path,station_client(),'get_stations','STATIONXML',
             network=net,station=sta,
             location=loc,channel=cha, 
             starttime=starttime,endtime=endtime,
@@ -753,18 +1381,25 @@ def get_stations(settings: SeismoLoaderSettings):
     # Add anything else we were told to
     if settings.station.force_stations: # config['STATION']['force_stations']:
         # add_list = config['STATION']['force_stations'].split(',') #format is NN.STA
-        for ele in settings.station.force_stations:
+        client = station_client()
+        def get_forced_station(ele):
             # n,s = ele.split('.')
             try:
-                inv += station_client.get_stations(
+                return client.get_stations(
                     network=ele.network,
                     station=ele.station,
                     level=settings.station.level.value
                 )
-            except:
+            except Exception:
                 # print("Could not find requested station %s at %s" % (ele,config['STATION']['client']))
                 print("Could not find requested station %s at %s" % (ele.cmb_str,settings.station.client.value))
-                continue
+                return None
+
+        # One query per station (a missing one only loses that station), sent together as above
+        with ThreadPoolExecutor(max_workers=STATION_QUERY_WORKERS) as executor:
+            for forced_inv in executor.map(get_forced_station, settings.station.force_stations):
+                if forced_inv is not None:
+                    inv += forced_inv
 
     return inv
 
@@ -772,12 +1407,6 @@ def get_stations(settings: SeismoLoaderSettings):
 def get_events(settings: SeismoLoaderSettings) -> List[Catalog]:
     starttime = UTCDateTime(settings.event.date_config.start_time)
     endtime = UTCDateTime(settings.event.date_config.end_time)
-    waveform_client = Client(settings.waveform.client.value) # note we may have three different clients here: waveform, station, and event. be careful to keep track
-    if settings.event and settings.event.client: # config['STATION']['client']:
-        event_client = Client(settings.event.client.value) # Client(config['STATION']['client'])
-    else:
-        event_client = waveform_client
-
     if settings.event.local_catalog:
         try:
             return obspy.read_events(settings.event.local_catalog)
@@ -788,37 +1417,49 @@ def get_events(settings: SeismoLoaderSettings) -> List[Catalog]:
         except Exception as e:
             raise Exception(f"An unexpected error occurred: {e}")
 
+    # Only set up a client once it's clear the server will be asked
+    # note we may have three different clients here: waveform, station, and event. be careful to keep track
+    if settings.event and settings.event.client: # config['STATION']['client']:
+        event_client = get_client(settings.event.client.value) # Client(config['STATION']['client'])
+    else:
+        event_client = get_client(settings.waveform.client.value)
+
+    # Query parameters shared by every geo constraint, built once; only the
+    # area-specific parameters are added per request
+    base_params = dict(
+        starttime=starttime,endtime=endtime,
+        minmagnitude= settings.event.min_magnitude, # float(config['EVENT']['minmagnitude']),
+        maxmagnitude= settings.event.max_magnitude, # float(config['EVENT']['maxmagnitude']),
+
+        #TODO add catalog,contributor
+        includeallorigins= settings.event.include_all_origins, # False,
+        includeallmagnitudes= settings.event.include_all_magnitudes, # False,
+        includearrivals= settings.event.include_arrivals, # False
+    )
+
     catalog = []    
     for geo in settings.event.geo_constraint:
         if geo.geo_type == GeoConstraintType.CIRCLE: # config['EVENT']['search_type'].lower() == 'radial':
             try:
-                cat = event_client.get_events(
-                    starttime=starttime,endtime=endtime,
-                    minmagnitude= settings.event.min_magnitude, # float(config['EVENT']['minmagnitude']),
-                    maxmagnitude= settings.event.max_magnitude, # float(config['EVENT']['maxmagnitude']),
-
+                cat = cached_query(settings.db_path,event_client,'get_events','QUAKEML',
+                    **base_params,
                     latitude = geo.coords.lat, # float(config['EVENT']['latitude']),
                     longitude= geo.coords.lng, # float(config['EVENT']['longitude']),
                     minradius= convert_radius_to_degrees(geo.coords.min_radius), # loat(config['EVENT']['minsearchradius']),
                     maxradius= convert_radius_to_degrees(geo.coords.max_radius), # float(config['EVENT']['maxsearchradius']),
-
-                    #TODO add catalog,contributor
-                    includeallorigins= settings.event.include_all_origins, # False,
-                    includeallmagnitudes= settings.event.include_all_magnitudes, # False,
-                    includearrivals= settings.event.include_arrivals, # False
                 )
                 print("Found %d events from %s" % (len(cat),settings.event.client.value))
                 catalog.extend(cat)
-            except:
-                print("No events found!") #TODO elaborate
+            except FDSNNoDataException:
+                print("No events found!")
+            except Exception as e:
+                print("Event search failed at %s: %s" % (settings.event.client.value,e))
                 # return catalog # sys.exit()
                 
         elif geo.geo_type == GeoConstraintType.BOUNDING: # 'box' in config['EVENT']['search_type'].lower():
             try:
-                cat = event_client.get_events(
-                    starttime=starttime,endtime=endtime,
-                    minmagnitude= settings.event.min_magnitude, # float(config['EVENT']['minmagnitude']),
-                    maxmagnitude= settings.event.max_magnitude, # float(config['EVENT']['maxmagnitude']),
+                cat = cached_query(settings.db_path,event_client,'get_events','QUAKEML',
+                    **base_params,
                     mindepth    = settings.event.min_depth,
                     maxdepth    = settings.event.max_depth,
 
@@ -826,16 +1467,13 @@ def get_events(settings: SeismoLoaderSettings) -> List[Catalog]:
                     minlongitude = geo.coords.min_lng, # float(config['EVENT']['minlongitude']),
                     maxlatitude  = geo.coords.max_lat, # float(config['EVENT']['maxlatitude']),
                     maxlongitude = geo.coords.max_lng, # float(config['EVENT']['maxlongitude']),
-
-                    #TODO add catalog,contributor
-                    includeallorigins= settings.event.include_all_origins, # False,
-                    includeallmagnitudes= settings.event.include_all_magnitudes, # False,
-                    includearrivals= settings.event.include_arrivals, # False
                 )
                 print("Found %d events from %s" % (len(cat),settings.event.client.value))
                 catalog.extend(cat)
-            except:
-                print("no events found!") #TODO elaborate
+            except FDSNNoDataException:
+                print("no events found!")
+            except Exception as e:
+                print("Event search failed at %s: %s" % (settings.event.client.value,e))
                 # return # sys.exit()
         else:
             # FIXME: Once concluded on Geo Type, fix below terms: radial and box
@@ -846,6 +1484,33 @@ def get_events(settings: SeismoLoaderSettings) -> List[Catalog]:
 
 
 
+def credentials_by_network(auths):
+    """
+    The credentials to use for each network. They may be given per NN.STA, but requests are routed per
+    network (archive_requests), so where several are given for one network the first is used and a warning printed.
+    """
+    creds = {}
+    for cred in auths:
+        cred_net = cred.nslc_code.split('.',1)[0]
+        if cred_net not in creds:
+            creds[cred_net] = cred
+        elif (cred.username,cred.password) != (creds[cred_net].username,creds[cred_net].password):
+            print("Warning: conflicting credentials for network %s, using those given for %s (ignoring %s)" % (cred_net,creds[cred_net].nslc_code,cred.nslc_code))
+    return creds
+
+def add_credentialed_clients(settings, waveform_clients, creds, requested_networks):
+    """ Add a client to waveform_clients for each requested network with credentials (see credentials_by_network) that has none yet. """
+    for cred_net, cred in creds.items():
+        if cred_net not in requested_networks or cred_net in waveform_clients:
+            continue
+        try:
+            new_client = get_client(settings.waveform.client.value,user=cred.username,password=cred.password)
+        except Exception:
+            print("Issue creating client: %s %s via %s:%s" % (settings.waveform.client,cred.nslc_code,cred.username,cred.password))
+            continue
+        waveform_clients.update({cred_net:new_client})
+
+
 def run_continuous(settings: SeismoLoaderSettings, inv: Inventory):
     """
     Retrieves continuous seismic data over long time intervals for a set of stations
@@ -889,7 +1554,7 @@ def run_continuous(settings: SeismoLoaderSettings, inv: Inventory):
 
     starttime = UTCDateTime(settings.station.date_config.start_time)
     endtime = UTCDateTime(settings.station.date_config.end_time)
-    waveform_client = Client(settings.waveform.client.value) # note we may have three different clients here: waveform, station, and event. be careful to keep track
+    waveform_client = get_client(settings.waveform.client.value) # note we may have three different clients here: waveform, station, and event. be careful to keep track
 
     # Collect requests
     requests = collect_requests(inv,starttime,endtime)
@@ -901,25 +1566,12 @@ def run_continuous(settings: SeismoLoaderSettings, inv: Inventory):
     combined_requests = combine_requests(pruned_requests)
 
     waveform_clients= {'open':waveform_client}
-    requested_networks = [ele[0] for ele in combined_requests]
-    for cred in settings.auths:
-        if cred.nslc_code not in requested_networks:
-            continue
-        try:
-            new_client = Client(settings.waveform.client,user=cred.username,password=cred.password)
-        except:
-            print("Issue creating client: %s %s via %s:%s" % (settings.waveform.client,cred.nslc_code,cred.username,cred.password))
-            continue
-        waveform_clients.update({cred.nslc_code:new_client})
+    requested_networks = {ele[0] for ele in combined_requests}
+    add_credentialed_clients(settings, waveform_clients, credentials_by_network(settings.auths), requested_networks)
 
     # Archive to disk and updated database
-    for request in combined_requests:
-        print(request)
-        time.sleep(0.05) #to help ctrl-C out if needed
-        try: 
-            archive_request(request, waveform_client, settings.sds_path, settings.db_path)
-        except:
-            print("Continous request not successful: ",request)
+    archive_requests(combined_requests, waveform_clients, settings.sds_path, settings.db_path,
+                     max_workers=settings.proccess.max_workers)
 
     # Goint through all original requests
     time_series = []
@@ -982,11 +1634,20 @@ def run_event(settings: SeismoLoaderSettings):
     - Care should be taken when modifying settings and handling authentication to ensure the integrity and security
       of data access and retrieval.
     """
+    # All events' series together, as the UI plots them (use iter_run_event to go one event at a time)
+    return [series for event_series in iter_run_event(settings) for series in event_series]
+
+
+def iter_run_event(settings: SeismoLoaderSettings):
+    """
+    Generator doing the work of run_event, yielding each event's time series (list of dicts, as
+    run_event returns) once that event is archived, so only one event's waveforms are held at a time.
+    """
     settings = setup_paths(settings)
 
-    waveform_client = Client(settings.waveform.client.value)
+    waveform_client = get_client(settings.waveform.client.value)
     
-    ttmodel = TauPyModel(settings.event.model) #  config['EVENT']['model'])
+    ttmodel = get_ttmodel(settings.event.model.value) #  config['EVENT']['model'])
 
     # @FIXME: Below line seems to be redundant as in above lines, event_client was set.
     # event_client = Client(config['EVENT']['client'])
@@ -994,6 +1655,11 @@ def run_event(settings: SeismoLoaderSettings):
     # minradius = settings.event.min_radius # float(config['EVENT']['minradius'])
     # maxradius = settings.event.max_radius # float(config['EVENT']['maxradius'])
 
+    # Clients (open, plus any restricted-data ones added below) are kept across events, so each is
+    # only set up once (creating a Client queries the server for its available services)
+    waveform_clients= {'open':waveform_client}
+    creds = credentials_by_network(settings.auths)
+
     #now loop through events
     # NOTE: Why "inv" collections from STATION block is included in EVENTS?
     #       Isn't it the STATIONS have their own searching settings?
@@ -1018,27 +1684,12 @@ def run_event(settings: SeismoLoaderSettings):
         combined_requests = combine_requests(pruned_requests)
 
         # Add additional clients if user is requesting any restricted data
-        waveform_clients= {'open':waveform_client}
-        requested_networks = [ele[0] for ele in combined_requests]
-
-        for cred in settings.auths:
-            if cred.nslc_code not in requested_networks:
-                continue
-            try:
-                new_client = Client(settings.waveform.client,user=cred.username,password=cred.password)
-            except:
-                print("Issue creating client: %s %s via %s:%s" % (settings.waveform.client,cred.nslc_code,cred.username,cred.password))
-                continue
-            waveform_clients.update({cred.nslc_code:new_client})
+        requested_networks = {ele[0] for ele in combined_requests}
+        add_credentialed_clients(settings, waveform_clients, creds, requested_networks)
 
         # Archive to disk and updated database
-        for request in combined_requests:
-            time.sleep(0.05) #to help ctrl-C out if needed
-            print(request)
-            try: 
-                archive_request(request,waveform_client,settings.sds_path,settings.db_path)
-            except Exception as e:
-                print("Event request not successful: ",request, str(e))
+        archive_requests(combined_requests,waveform_clients,settings.sds_path,settings.db_path,
+                         max_workers=settings.proccess.max_workers)
         
         time_series = []
         for req in requests:
@@ -1063,8 +1714,8 @@ def run_event(settings: SeismoLoaderSettings):
                 'Channel': query.channel,
                 'Data': data
             })
-            
-        return time_series
+
+        yield time_series
 
 
 
@@ -1073,27 +1724,34 @@ def run_main(settings: SeismoLoaderSettings = None, from_file=None):
         settings = SeismoLoaderSettings()
         settings = settings.from_cfg_file(cfg_path = from_file)
 
-    settings = setup_paths(settings)
-
-    download_type = settings.download_type.value # config['PROCESSING']['download_type'].lower()
-    if not is_in_enum(download_type, DownloadType):
-        download_type = DownloadType.CONTIN # 'continuous' # default
-
-
-    if download_type == DownloadType.CONTIN:
-        inv = get_stations(settings)
-        run_continuous(settings, inv)
-
-    if download_type == DownloadType.EVENT:
-        catalog = get_events(settings)
-        inv     = get_stations(settings)
-        run_event(settings, inv, catalog)
-    # Now we can optionally clean up our database (stich continous segments, etc)
-    print("\n ~~ Cleaning up database ~~")
-    join_continuous_segments(settings.db_path, settings.proccess.gap_tolerance) # gap_tolerance=float(config['PROCESSING']['gap_tolerance']))
-
-    # And print the contents (first 100 elements), for now (DEBUG / TESTING feature)
-    display_database_contents(settings.db_path,100)
+    try:
+        settings = setup_paths(settings)
+
+        download_type = settings.download_type.value # config['PROCESSING']['download_type'].lower()
+        if not is_in_enum(download_type, DownloadType):
+            download_type = DownloadType.CONTIN # 'continuous' # default
+
+
+        if download_type == DownloadType.CONTIN:
+            inv = get_stations(settings)
+            run_continuous(settings, inv)
+
+        if download_type == DownloadType.EVENT:
+            catalog = get_events(settings)
+            inv     = get_stations(settings)
+            settings.event.selected_catalogs = catalog
+            settings.station.selected_invs   = inv
+            for _ in iter_run_event(settings): # nothing to show from the CLI, so don't keep any event's waveforms around
+                pass
+        # Now we can optionally clean up our database (stich continous segments, etc)
+        print("\n ~~ Cleaning up database ~~")
+        join_continuous_segments(settings.db_path, settings.proccess.gap_tolerance) # gap_tolerance=float(config['PROCESSING']['gap_tolerance']))
+
+        # And print the contents (first 100 elements), for now (DEBUG / TESTING feature)
+        display_database_contents(settings.db_path,100)
+    finally:
+        # Done with the database; close this thread's cached connection (db.get_db_connection) rather than leave it to exit
+        close_db_connections()
 
 
 ################ end function declarations, start program
@@ -10,7 +10,6 @@ We should also be able to support multi-select areas.
 
 import pandas as pd
 import streamlit as st
-import requests
 
 from seismic_data.models.config import SeismoLoaderSettings
 from seismic_data.service.seismoloader import get_stations
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import os
 import obspy
@@ -9,18 +10,21 @@ from seismic_data.service.db import safe_db_connection
 from seismic_data.models.exception import NotFoundError
 
 def stream_to_dataframe(stream):
-    df = pd.DataFrame()
+    trace_dfs = []
     for trace in stream:
+        # Sample times straight as datetime64[ns]: each is the start time plus i / sampling_rate, rounded
+        # to the nanosecond per sample (a rounded sample interval would drift over long traces)
+        offsets_ns = np.round(np.arange(trace.stats.npts) * 1e9 / trace.stats.sampling_rate).astype(np.int64)
         data = {
-            'time': trace.times("matplotlib"),  # Times in days since '0001-01-01'
+            'time': pd.to_datetime(trace.stats.starttime.ns + offsets_ns, unit='ns'),
             'amplitude': trace.data,
             'channel': trace.stats.channel
         }
-        trace_df = pd.DataFrame(data)
-        # Adjust origin to '1970-01-01' to avoid overflow
-        trace_df['time'] = pd.to_datetime(trace_df['time'], unit='D', origin=pd.Timestamp('1970-01-01'))
-        df = pd.concat([df, trace_df], ignore_index=True)
-    return df
+        trace_dfs.append(pd.DataFrame(data))
+    # One concat at the end, rather than copying the growing frame once per trace
+    if not trace_dfs:
+        return pd.DataFrame()
+    return pd.concat(trace_dfs, ignore_index=True)
 
 
 def check_is_archived(cursor, req: SeismoQuery): 
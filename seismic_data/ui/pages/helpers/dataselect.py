@@ -6,7 +6,6 @@ from obspy import UTCDateTime
 import pandas as pd
 import matplotlib.pyplot as plt
 from obspy.geodetics.base import locations2degrees
-from obspy.taup import TauPyModel
 
 
 from seismic_data.service.seismoloader import (
@@ -15,6 +14,7 @@ from seismic_data.service.seismoloader import (
     prune_requests,
     combine_requests,
     archive_request,
+    get_ttmodel,
     join_continuous_segments,
     display_database_contents,
 )
@@ -100,7 +100,7 @@ elif download_type == "Event":
             level="channel",
         )
 
-        ttmodel = TauPyModel()
+        ttmodel = get_ttmodel()
 
         progress_bar = st.progress(0)
         for i, eq in enumerate(cat):